@@ -2,6 +2,7 @@ import glob
 import os.path as osp
 import pandas as pd
 
+import config as cfg
 from evaluation_measures import psds_score, compute_psds_from_operating_points, compute_metrics
 from utilities.utils import generate_tsv_wav_durations
 
@@ -20,7 +21,7 @@ if __name__ == '__main__':
     
     # Evaluate a single prediction
     single_predictions = pd.read_csv(base_prediction_path + ".tsv", sep="\t")
-    compute_metrics(single_predictions, groundtruth, meta_dur_df)
+    compute_metrics(single_predictions, groundtruth, meta_dur_df, n_jobs=cfg.num_workers)
 
     # Evaluate predictions with multiple thresholds (better). Need a list of predictions.
     prediction_list_path = glob.glob(osp.join(base_prediction_path, "*.tsv"))
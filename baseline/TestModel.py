@@ -11,7 +11,8 @@ from data_utils.DataLoad import DataLoadDf
 from data_utils.Desed import DESED
 from evaluation_measures import psds_score, get_predictions, \
     compute_psds_from_operating_points, compute_metrics
-from utilities.utils import to_cuda_if_available, generate_tsv_wav_durations, meta_path_to_audio_dir
+from utilities.utils import to_cuda_if_available, generate_tsv_wav_durations, meta_path_to_audio_dir, \
+    set_inference_backends
 from utilities.ManyHotEncoder import ManyHotEncoder
 from utilities.Transforms import get_transforms
 from utilities.Logger import create_logger
@@ -35,6 +36,15 @@ def _load_crnn(state, model_name="model"):
     return crnn
 
 
+def _compile_for_inference(model):
+    """ Compile the model for the predictions (torch >= 2.0 and GPU), the compiled module shares the parameters of
+    model. The model itself is returned if it cannot be compiled.
+    """
+    if hasattr(torch, "compile") and torch.cuda.is_available():
+        return torch.compile(model, mode="reduce-overhead")
+    return model
+
+
 def _load_scaler(state):
     scaler_state = state["scaler"]
     type_sc = scaler_state["type"]
@@ -57,7 +67,8 @@ def _load_state_vars(state, gtruth_df, median_win=None):
     transforms_valid = get_transforms(cfg.max_frames, scaler=scaler, add_axis=0)
 
     strong_dataload = DataLoadDf(pred_df, many_hot_encoder.encode_strong_df, transforms_valid, return_indexes=True)
-    strong_dataloader_ind = DataLoader(strong_dataload, batch_size=cfg.batch_size, drop_last=False)
+    strong_dataloader_ind = DataLoader(strong_dataload, batch_size=cfg.batch_size, drop_last=False,
+                                       pin_memory=torch.cuda.is_available())
 
     pooling_time_ratio = state["pooling_time_ratio"]
     many_hot_encoder = ManyHotEncoder.load_state_dict(state["many_hot_encoder"])
@@ -123,6 +134,7 @@ if __name__ == '__main__':
     parser.add_argument("-n", '--nb_files', type=int, default=None,
                         help="Number of files to be used. Useful when testing on small number of files.")
     f_args = parser.parse_args()
+    set_inference_backends()
 
     # Get variables from f_args
     model_path, median_window, gt_audio_dir, groundtruth, durations = get_variables(f_args)
@@ -139,7 +151,7 @@ if __name__ == '__main__':
                                          params["many_hot_encoder"].decode_strong, params["pooling_time_ratio"],
                                          median_window=params["median_window"],
                                          save_predictions=f_args.save_predictions_path)
-    compute_metrics(single_predictions, groundtruth, durations)
+    compute_metrics(single_predictions, groundtruth, durations, n_jobs=cfg.num_workers)
 
     # ##########
     # Optional but recommended
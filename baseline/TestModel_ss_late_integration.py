@@ -2,10 +2,8 @@
 import argparse
 import os
 import os.path as osp
-import scipy
 
 import torch
-from dcase_util.data import ProbabilityEncoder
 import pandas as pd
 import numpy as np
 
@@ -13,7 +11,9 @@ from data_utils.DataLoad import DataLoadDf
 from data_utils.Desed import DESED
 from TestModel import _load_scaler, _load_crnn
 from evaluation_measures import psds_score, compute_psds_from_operating_points, compute_metrics
-from utilities.utils import to_cuda_if_available, generate_tsv_wav_durations, meta_path_to_audio_dir
+from utilities.utils import to_cuda_if_available, generate_tsv_wav_durations, meta_path_to_audio_dir, \
+    set_inference_backends
+from utilities.decoding import binarize, binary_median_filter
 from utilities.ManyHotEncoder import ManyHotEncoder
 from utilities.Transforms import get_transforms
 from utilities.Logger import create_logger
@@ -68,10 +68,8 @@ def get_predictions_ss_late_integration(model, valid_dataload, decoder, pooling_
 
         # Get different post processing per threshold
         for threshold in thresholds:
-            pred_strong_bin = ProbabilityEncoder().binarization(pred_strong_comb,
-                                                                binarization_type="global_threshold",
-                                                                threshold=threshold)
-            pred_strong_m = scipy.ndimage.filters.median_filter(pred_strong_bin, (median_window, 1))
+            pred_strong_bin = binarize(pred_strong_comb, threshold)
+            pred_strong_m = binary_median_filter(pred_strong_bin, median_window)
             pred = decoder(pred_strong_m)
             pred = pd.DataFrame(pred, columns=["event_label", "onset", "offset"])
             # Put them in seconds
@@ -201,6 +199,7 @@ if __name__ == '__main__':
     parser.add_argument("-n", '--nb_files', type=int, default=None,
                         help="Number of files to be used. Useful when testing on small number of files.")
     f_args = parser.parse_args()
+    set_inference_backends()
 
     # Get variables from f_args
     model_path, median_window, gt_audio_dir, durations, keep_sources = get_variables(f_args)
@@ -221,7 +220,7 @@ if __name__ == '__main__':
                                                              median_window=params["median_window"],
                                                              save_predictions=f_args.save_predictions_path,
                                                              alpha=alpha_norm)
-    compute_metrics(single_predictions, groundtruth, durations)
+    compute_metrics(single_predictions, groundtruth, durations, n_jobs=cfg.num_workers)
 
     # ##########
     # Optional but recommended
@@ -1,10 +1,10 @@
 # -*- coding: utf-8 -*-
+import copy
+import multiprocessing
 import os
 from os import path as osp
 
 import psds_eval
-import scipy
-from dcase_util.data import ProbabilityEncoder
 import sed_eval
 import numpy as np
 import pandas as pd
@@ -13,7 +13,8 @@ from psds_eval import plot_psd_roc, PSDSEval
 
 import config as cfg
 from utilities.Logger import create_logger
-from utilities.utils import to_cuda_if_available
+from utilities.decoding import binarize, binary_median_filter, decode_batch
+from utilities.utils import inference_context, to_cuda_if_available
 from utilities.ManyHotEncoder import ManyHotEncoder
 
 logger = create_logger(__name__, terminal_level=cfg.terminal_level)
@@ -38,7 +39,96 @@ def get_event_list_current_file(df, fname):
     return event_list_for_current_file
 
 
-def event_based_evaluation_df(reference, estimated, t_collar=0.200, percentage_of_length=0.2):
+def get_event_lists_by_file(df):
+    """
+    Get the list of events of every filename, grouping the dataframe once instead of searching it for each file
+    :param df: pd.DataFrame, the dataframe containing "filename" "onset" "offset" and "event_label" columns
+    :return: dict, filename: list of events (dictionaries with only these 4 keys used by sed_eval),
+        like get_event_list_current_file
+    """
+    # Python lists of the columns, the dictionaries are built directly instead of using to_dict('records')
+    filenames = df["filename"].to_numpy().tolist()
+    onsets = df["onset"].to_numpy().tolist()
+    offsets = df["offset"].to_numpy().tolist()
+    event_labels = df["event_label"].to_numpy().tolist()
+    # A file without events is a single row with a NaN event_label
+    no_event = df["event_label"].isna().to_numpy()
+
+    event_lists = {}
+    for fname, idxs in df.groupby("filename", sort=False).indices.items():
+        if len(idxs) == 1 and no_event[idxs[0]]:
+            event_lists[fname] = [{"filename": fname}]
+        else:
+            event_lists[fname] = [{"filename": filenames[i], "onset": onsets[i], "offset": offsets[i],
+                                   "event_label": event_labels[i]} for i in idxs]
+    return event_lists
+
+
+def _evaluate_files(args):
+    """ Evaluate a list of files with a new sed_eval metric (worker of evaluate_sed_eval_metric) """
+    metric_class, metric_kwargs, event_lists = args
+    metric = metric_class(**metric_kwargs)
+    for reference_event_list, estimated_event_list in event_lists:
+        metric.evaluate(
+            reference_event_list=reference_event_list,
+            estimated_event_list=estimated_event_list
+        )
+    return metric
+
+
+def _merge_metrics(metric, partial_metrics):
+    """ Sum the counts of sed_eval metrics evaluated on different files in metric """
+    for partial_metric in partial_metrics:
+        for key in metric.overall:
+            metric.overall[key] += partial_metric.overall[key]
+        for class_label in metric.class_wise:
+            for key in metric.class_wise[class_label]:
+                metric.class_wise[class_label][key] += partial_metric.class_wise[class_label][key]
+        metric.evaluated_files += partial_metric.evaluated_files
+        # EventBasedMetrics and SegmentBasedMetrics do not name the evaluated length the same way
+        for length_attribute in ["evaluated_length_seconds", "evaluated_length"]:
+            if hasattr(metric, length_attribute):
+                setattr(metric, length_attribute,
+                        getattr(metric, length_attribute) + getattr(partial_metric, length_attribute))
+    return metric
+
+
+def evaluate_sed_eval_metric(metric_class, metric_kwargs, reference, estimated, n_jobs=1):
+    """ Evaluate a sed_eval metric on every file of the reference, the files are split between n_jobs processes
+
+    Args:
+        metric_class: class, sed_eval.sound_event.EventBasedMetrics or sed_eval.sound_event.SegmentBasedMetrics
+        metric_kwargs: dict, the parameters of the metric
+        reference: pd.DataFrame containing "filename" "onset" "offset" and "event_label" columns which describe the
+            reference events
+        estimated: pd.DataFrame containing "filename" "onset" "offset" and "event_label" columns which describe the
+            estimated events to be compared with reference
+        n_jobs: int, (Default value = 1) number of processes, 1 evaluates in this process, None uses all the cpus.
+            A pool is created at each call, only worth it for large sets
+    Returns:
+         metric_class object with the scores
+    """
+    evaluated_files = reference["filename"].unique()
+    reference_event_lists = get_event_lists_by_file(reference)
+    estimated_event_lists = get_event_lists_by_file(estimated)
+    event_lists = [(reference_event_lists[fname], estimated_event_lists.get(fname, [])) for fname in evaluated_files]
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count()
+    n_jobs = max(min(n_jobs, len(event_lists)), 1)
+    if n_jobs == 1:
+        return _evaluate_files((metric_class, metric_kwargs, event_lists))
+
+    # Contiguous chunks, the per file counts are summed afterwards
+    chunk_size = int(np.ceil(len(event_lists) / n_jobs))
+    chunks = [(metric_class, metric_kwargs, event_lists[i:i + chunk_size])
+              for i in range(0, len(event_lists), chunk_size)]
+    with multiprocessing.Pool(n_jobs) as pool:
+        partial_metrics = pool.map(_evaluate_files, chunks)
+    return _merge_metrics(metric_class(**metric_kwargs), partial_metrics)
+
+
+def event_based_evaluation_df(reference, estimated, t_collar=0.200, percentage_of_length=0.2, n_jobs=1):
     """ Calculate EventBasedMetric given a reference and estimated dataframe
 
     Args:
@@ -48,37 +138,29 @@ def event_based_evaluation_df(reference, estimated, t_collar=0.200, percentage_o
             estimated events to be compared with reference
         t_collar: float, in seconds, the number of time allowed on onsets and offsets
         percentage_of_length: float, between 0 and 1, the percentage of length of the file allowed on the offset
+        n_jobs: int, (Default value = 1) number of processes used to evaluate the files, see evaluate_sed_eval_metric
     Returns:
          sed_eval.sound_event.EventBasedMetrics with the scores
     """
 
-    evaluated_files = reference["filename"].unique()
-
     classes = []
     classes.extend(reference.event_label.dropna().unique())
     classes.extend(estimated.event_label.dropna().unique())
     classes = list(set(classes))
 
-    event_based_metric = sed_eval.sound_event.EventBasedMetrics(
+    metric_kwargs = dict(
         event_label_list=classes,
         t_collar=t_collar,
         percentage_of_length=percentage_of_length,
         empty_system_output_handling='zero_score'
     )
-
-    for fname in evaluated_files:
-        reference_event_list_for_current_file = get_event_list_current_file(reference, fname)
-        estimated_event_list_for_current_file = get_event_list_current_file(estimated, fname)
-
-        event_based_metric.evaluate(
-            reference_event_list=reference_event_list_for_current_file,
-            estimated_event_list=estimated_event_list_for_current_file,
-        )
+    event_based_metric = evaluate_sed_eval_metric(sed_eval.sound_event.EventBasedMetrics, metric_kwargs,
+                                                  reference, estimated, n_jobs=n_jobs)
 
     return event_based_metric
 
 
-def segment_based_evaluation_df(reference, estimated, time_resolution=1.):
+def segment_based_evaluation_df(reference, estimated, time_resolution=1., n_jobs=1):
     """ Calculate SegmentBasedMetrics given a reference and estimated dataframe
 
         Args:
@@ -87,29 +169,22 @@ def segment_based_evaluation_df(reference, estimated, time_resolution=1.):
             estimated: pd.DataFrame containing "filename" "onset" "offset" and "event_label" columns which describe the
                 estimated events to be compared with reference
             time_resolution: float, the time resolution of the segment based metric
+            n_jobs: int, (Default value = 1) number of processes used to evaluate the files,
+                see evaluate_sed_eval_metric
         Returns:
              sed_eval.sound_event.SegmentBasedMetrics with the scores
         """
-    evaluated_files = reference["filename"].unique()
-
     classes = []
     classes.extend(reference.event_label.dropna().unique())
     classes.extend(estimated.event_label.dropna().unique())
     classes = list(set(classes))
 
-    segment_based_metric = sed_eval.sound_event.SegmentBasedMetrics(
+    metric_kwargs = dict(
         event_label_list=classes,
         time_resolution=time_resolution
     )
-
-    for fname in evaluated_files:
-        reference_event_list_for_current_file = get_event_list_current_file(reference, fname)
-        estimated_event_list_for_current_file = get_event_list_current_file(estimated, fname)
-
-        segment_based_metric.evaluate(
-            reference_event_list=reference_event_list_for_current_file,
-            estimated_event_list=estimated_event_list_for_current_file
-        )
+    segment_based_metric = evaluate_sed_eval_metric(sed_eval.sound_event.SegmentBasedMetrics, metric_kwargs,
+                                                    reference, estimated, n_jobs=n_jobs)
 
     return segment_based_metric
 
@@ -119,9 +194,11 @@ def get_predictions(model, dataloader, decoder, pooling_time_ratio=1, thresholds
     """ Get the predictions of a trained model on a specific set
     Args:
         model: torch.Module, a trained pytorch model (you usually want it to be in .eval() mode).
-        dataloader: torch.utils.data.DataLoader, giving ((input_data, label), indexes) but label is not used here
+        dataloader: torch.utils.data.DataLoader, giving ((input_data, label), indexes) but label is not used here,
+            build it with pin_memory=True so the copies to the GPU are asynchronous
         decoder: function, takes a numpy.array of shape (time_steps, n_labels) as input and return a list of lists
             of ("event_label", "onset", "offset") for each label predicted.
+            If it is ManyHotEncoder.decode_strong, the batch is median filtered and decoded at once with decode_batch.
         pooling_time_ratio: the division to make between timesteps as input and timesteps as output
         median_window: int, the median window (in number of time steps) to be applied
         save_predictions: str or list, the path of the base_filename to save the predictions or a list of names
@@ -132,41 +209,71 @@ def get_predictions(model, dataloader, decoder, pooling_time_ratio=1, thresholds
         dict of the different predictions with associated threshold
     """
 
-    # Init a dataframe per threshold
-    prediction_dfs = {}
+    # The many hot encoder decoding can be done on the whole batch at once, other decoders are applied per file
+    labels = None
+    encoder = getattr(decoder, "__self__", None)
+    if isinstance(encoder, ManyHotEncoder) and decoder.__func__ is ManyHotEncoder.decode_strong:
+        labels = np.asarray(encoder.labels)
+
+    # Frames to seconds
+    frames_to_seconds = float(pooling_time_ratio) * float(cfg.hop_size) / float(cfg.sample_rate)
+
+    # Init a list of dataframes per threshold, concatenated once all the batches are decoded
+    prediction_chunks = {}
     for threshold in thresholds:
-        prediction_dfs[threshold] = pd.DataFrame()
+        prediction_chunks[threshold] = []
 
     # Get predictions
     for i, ((input_data, _), indexes) in enumerate(dataloader):
         indexes = indexes.numpy()
-        input_data = to_cuda_if_available(input_data)
-        with torch.no_grad():
+        input_data = to_cuda_if_available(input_data, non_blocking=True)
+        with inference_context():
             pred_strong, _ = model(input_data)
-        pred_strong = pred_strong.cpu()
-        pred_strong = pred_strong.detach().numpy()
+        pred_strong = pred_strong.float().cpu()
+        pred_strong = pred_strong.numpy()
         if i == 0:
             logger.debug(pred_strong)
 
         # Post processing and put predictions in a dataframe
-        for j, pred_strong_it in enumerate(pred_strong):
+        if labels is not None:
+            filenames = dataloader.dataset.filenames.iloc[indexes].to_numpy()
             for threshold in thresholds:
-                pred_strong_bin = ProbabilityEncoder().binarization(pred_strong_it,
-                                                                    binarization_type="global_threshold",
-                                                                    threshold=threshold)
-                pred_strong_m = scipy.ndimage.filters.median_filter(pred_strong_bin, (median_window, 1))
-                pred = decoder(pred_strong_m)
-                pred = pd.DataFrame(pred, columns=["event_label", "onset", "offset"])
+                pred_strong_bin = binarize(pred_strong, threshold)
+                file_idx, class_idx, onsets, offsets = decode_batch(pred_strong_bin, median_window)
                 # Put them in seconds
-                pred.loc[:, ["onset", "offset"]] *= pooling_time_ratio / (cfg.sample_rate / cfg.hop_size)
-                pred.loc[:, ["onset", "offset"]] = pred[["onset", "offset"]].clip(0, cfg.max_len_seconds)
+                pred = pd.DataFrame({"event_label": labels[class_idx],
+                                     "onset": np.clip(onsets * frames_to_seconds, 0, cfg.max_len_seconds),
+                                     "offset": np.clip(offsets * frames_to_seconds, 0, cfg.max_len_seconds)})
 
-                pred["filename"] = dataloader.dataset.filenames.iloc[indexes[j]]
-                prediction_dfs[threshold] = prediction_dfs[threshold].append(pred, ignore_index=True)
+                pred["filename"] = filenames[file_idx]
+                prediction_chunks[threshold].append(pred)
 
-                if i == 0 and j == 0:
+                if i == 0:
                     logger.debug("predictions: \n{}".format(pred))
-                    logger.debug("predictions strong: \n{}".format(pred_strong_it))
+        else:
+            for j, pred_strong_it in enumerate(pred_strong):
+                for threshold in thresholds:
+                    pred_strong_bin = binarize(pred_strong_it, threshold)
+                    pred_strong_m = binary_median_filter(pred_strong_bin, median_window)
+                    pred = decoder(pred_strong_m)
+                    pred = pd.DataFrame(pred, columns=["event_label", "onset", "offset"])
+                    # Put them in seconds
+                    pred.loc[:, ["onset", "offset"]] *= frames_to_seconds
+                    pred.loc[:, ["onset", "offset"]] = pred[["onset", "offset"]].clip(0, cfg.max_len_seconds)
+
+                    pred["filename"] = dataloader.dataset.filenames.iloc[indexes[j]]
+                    prediction_chunks[threshold].append(pred)
+
+                    if i == 0 and j == 0:
+                        logger.debug("predictions: \n{}".format(pred))
+                        logger.debug("predictions strong: \n{}".format(pred_strong_it))
+
+    prediction_dfs = {}
+    for threshold in thresholds:
+        if prediction_chunks[threshold]:
+            prediction_dfs[threshold] = pd.concat(prediction_chunks[threshold], ignore_index=True)
+        else:
+            prediction_dfs[threshold] = pd.DataFrame(columns=["event_label", "onset", "offset", "filename"])
 
     # Save predictions
     if save_predictions is not None:
@@ -227,16 +334,48 @@ def psds_score(psds, filename_roc_curves=None):
         logger.error(e)
 
 
-def compute_sed_eval_metrics(predictions, groundtruth):
+def compute_sed_eval_metrics(predictions, groundtruth, n_jobs=1):
     metric_event = event_based_evaluation_df(groundtruth, predictions, t_collar=0.200,
-                                             percentage_of_length=0.2)
-    metric_segment = segment_based_evaluation_df(groundtruth, predictions, time_resolution=1.)
+                                             percentage_of_length=0.2, n_jobs=n_jobs)
+    metric_segment = segment_based_evaluation_df(groundtruth, predictions, time_resolution=1., n_jobs=n_jobs)
     logger.info(metric_event)
     logger.info(metric_segment)
 
     return metric_event
 
 
+def format_df_fast(df, classes, filenames=None):
+    """ Encode the weak labels of each file of a dataframe (one row per event) in a boolean matrix
+    Args:
+        df: pd.DataFrame, the dataframe with filename and event_label columns (event_label NaN for a file without
+            events)
+        classes: list, the classes to encode, in the order of the columns
+        filenames: list or np.array, (Default value = None) the filenames of the rows of the matrix, it has to contain
+            all the filenames of df (files not in df have no label). If None, the filenames of df.
+
+    Returns:
+        tuple
+        (np.array of the filenames (no duplicates, order of appearance if not given),
+        np.array of shape (n_files, len(classes)) True where the label is present in the file)
+    """
+    label_to_idx = {label: i for i, label in enumerate(classes)}
+    if filenames is None:
+        filenames = df["filename"].drop_duplicates()
+    filenames = pd.Index(filenames)
+    labels_df = df.dropna(subset=["event_label"])
+    rows = filenames.get_indexer(labels_df["filename"])
+    if (rows < 0).any():
+        raise ValueError(f"filenames of df missing in filenames: {labels_df['filename'][rows < 0].unique().tolist()}")
+    cols = labels_df["event_label"].map(label_to_idx)
+    if cols.isna().any():
+        raise ValueError(f"labels of df missing in classes: {labels_df['event_label'][cols.isna()].unique().tolist()}")
+    cols = cols.to_numpy(dtype=np.int64)
+
+    encoded = np.zeros((len(filenames), len(classes)), dtype=np.bool_)
+    encoded[rows, cols] = True
+    return filenames.to_numpy(), encoded
+
+
 def format_df(df, mhe):
     """ Make a weak labels dataframe from strongly labeled (join labels)
     Args:
@@ -246,12 +385,9 @@ def format_df(df, mhe):
     Returns:
         weakly labeled dataframe
     """
-    def join_labels(x):
-        return pd.Series(dict(filename=x['filename'].iloc[0],
-                              event_label=mhe.encode_weak(x["event_label"].drop_duplicates().dropna().tolist())))
-
     if "onset" in df.columns or "offset" in df.columns:
-        df = df.groupby("filename", as_index=False).apply(join_labels)
+        filenames, encoded = format_df_fast(df, mhe.labels)
+        df = pd.DataFrame({"filename": filenames, "event_label": list(encoded.astype(float))})
     return df
 
 
@@ -259,65 +395,61 @@ def get_f_measure_by_class(torch_model, nb_tags, dataloader_, thresholds_=None):
     """ get f measure for each class given a model and a generator of data (batch_x, y)
 
     Args:
-        torch_model : Model, model to get predictions, forward should return weak and strong predictions
+        torch_model : Model, model to get predictions, forward should return weak and strong predictions. It has to be
+            on the GPU already if one is available (moved once by the caller and not at each call)
         nb_tags : int, number of classes which are represented
-        dataloader_ : generator, data generator used to get f_measure
+        dataloader_ : generator, data generator used to get f_measure, (use pin_memory=True for a DataLoader so the
+            copies to the GPU are asynchronous)
         thresholds_ : int or list, thresholds to apply to each class to binarize probabilities
 
     Returns:
         macro_f_measure : list, f measure for each class
 
     """
-    if torch.cuda.is_available():
-        torch_model = torch_model.cuda()
-
-    # Calculate external metrics
-    tp = np.zeros(nb_tags)
-    tn = np.zeros(nb_tags)
-    fp = np.zeros(nb_tags)
-    fn = np.zeros(nb_tags)
+    assert not torch.cuda.is_available() or next(torch_model.parameters()).is_cuda, \
+        "the model should be on the GPU, use to_cuda_if_available before calling get_f_measure_by_class"
+
+    # Calculate external metrics, counts are accumulated on the model device and moved to cpu once at the end
+    device = next(torch_model.parameters()).device
+    tp = torch.zeros(nb_tags, dtype=torch.long, device=device)
+    tn = torch.zeros(nb_tags, dtype=torch.long, device=device)
+    fp = torch.zeros(nb_tags, dtype=torch.long, device=device)
+    fn = torch.zeros(nb_tags, dtype=torch.long, device=device)
+
+    # A scalar or a (1, nb_tags) row, both broadcast over the batch axis
+    if thresholds_ is None:
+        thresh = torch.tensor(0.5, dtype=torch.float32, device=device)
+    else:
+        assert type(thresholds_) is list
+        thresh = torch.tensor(thresholds_, dtype=torch.float32, device=device)[None, :]
     for counter, (batch_x, y) in enumerate(dataloader_):
         if torch.cuda.is_available():
-            batch_x = batch_x.cuda()
+            batch_x = batch_x.cuda(non_blocking=True)
 
-        pred_strong, pred_weak = torch_model(batch_x)
-        pred_weak = pred_weak.cpu().data.numpy()
-        labels = y.numpy()
+        with inference_context():
+            pred_strong, pred_weak = torch_model(batch_x)
+        pred_weak = pred_weak.float()
+        labels = y.to(pred_weak.device, non_blocking=True)
 
         # Used only with a model predicting only strong outputs
-        if len(pred_weak.shape) == 3:
+        if pred_weak.dim() == 3:
             # average data to have weak labels
-            pred_weak = np.max(pred_weak, axis=1)
+            pred_weak = pred_weak.amax(dim=1)
 
-        if len(labels.shape) == 3:
-            labels = np.max(labels, axis=1)
-            labels = ProbabilityEncoder().binarization(labels,
-                                                       binarization_type="global_threshold",
-                                                       threshold=0.5)
+        if labels.dim() == 3:
+            labels = labels.amax(dim=1)
+        labels = labels >= 0.5
 
-        if thresholds_ is None:
-            binarization_type = 'global_threshold'
-            thresh = 0.5
-        else:
-            binarization_type = "class_threshold"
-            assert type(thresholds_) is list
-            thresh = thresholds_
-
-        batch_predictions = ProbabilityEncoder().binarization(pred_weak,
-                                                              binarization_type=binarization_type,
-                                                              threshold=thresh,
-                                                              time_axis=0
-                                                              )
-
-        tp_, fp_, fn_, tn_ = intermediate_at_measures(labels, batch_predictions)
-        tp += tp_
-        fp += fp_
-        fn += fn_
-        tn += tn_
-
-    macro_f_score = np.zeros(nb_tags)
-    mask_f_score = 2 * tp + fp + fn != 0
-    macro_f_score[mask_f_score] = 2 * tp[mask_f_score] / (2 * tp + fp + fn)[mask_f_score]
+        batch_predictions = pred_weak >= thresh
+
+        tp += (batch_predictions & labels).sum(dim=0)
+        fp += (batch_predictions & ~labels).sum(dim=0)
+        fn += (~batch_predictions & labels).sum(dim=0)
+        tn += (~batch_predictions & ~labels).sum(dim=0)
+
+    # Integer counts (int64) until the division
+    tp, fp, fn, tn = (count.cpu().numpy() for count in (tp, fp, fn, tn))
+    macro_f_score = macro_f_measure(tp, fp, fn)
 
     return macro_f_score
 
@@ -334,10 +466,14 @@ def intermediate_at_measures(encoded_ref, encoded_est):
         number of (true positives, false positives, false negatives, true negatives)
 
     """
-    tp = (encoded_est + encoded_ref == 2).sum(axis=0)
-    fp = (encoded_est - encoded_ref == 1).sum(axis=0)
-    fn = (encoded_ref - encoded_est == 1).sum(axis=0)
-    tn = (encoded_est + encoded_ref == 0).sum(axis=0)
+    ref = np.asarray(encoded_ref).astype(np.bool_, copy=False)
+    est = np.asarray(encoded_est).astype(np.bool_, copy=False)
+
+    # One logical op and three reductions, the other counts are derived from the totals
+    tp = np.logical_and(est, ref).sum(axis=0, dtype=np.int64)
+    fp = est.sum(axis=0, dtype=np.int64) - tp
+    fn = ref.sum(axis=0, dtype=np.int64) - tp
+    tn = est.shape[0] - tp - fp - fn
     return tp, fp, fn, tn
 
 
@@ -353,9 +489,9 @@ def macro_f_measure(tp, fp, fn):
         float
         The macro F-measure
     """
-    macro_f_score = np.zeros(tp.shape[-1])
-    mask_f_score = 2 * tp + fp + fn != 0
-    macro_f_score[mask_f_score] = 2 * tp[mask_f_score] / (2 * tp + fp + fn)[mask_f_score]
+    denom = 2 * tp + fp + fn
+    macro_f_score = np.zeros(denom.shape, dtype=np.float64)
+    np.divide(2 * tp, denom, out=macro_f_score, where=denom != 0)
     return macro_f_score
 
 
@@ -365,51 +501,78 @@ def audio_tagging_results(reference, estimated):
         classes.extend(reference.event_label.dropna().unique())
         classes.extend(estimated.event_label.dropna().unique())
         classes = list(set(classes))
-        mhe = ManyHotEncoder(classes)
-        reference = format_df(reference, mhe)
-        estimated = format_df(estimated, mhe)
     else:
         classes.extend(reference.event_labels.str.split(',', expand=True).unstack().dropna().unique())
         classes.extend(estimated.event_labels.str.split(',', expand=True).unstack().dropna().unique())
         classes = list(set(classes))
-        mhe = ManyHotEncoder(classes)
+        # One row per (filename, event_label) like the strongly labeled dataframes
+        reference = reference.assign(event_label=reference.event_labels.str.split(',')).explode("event_label")
+        estimated = estimated.assign(event_label=estimated.event_labels.str.split(',')).explode("event_label")
 
-    matching = reference.merge(estimated, how='outer', on="filename", suffixes=["_ref", "_pred"])
-
-    def na_values(val):
-        if type(val) is np.ndarray:
-            return val
-        if pd.isna(val):
-            return np.zeros(len(classes))
-        return val
+    # Outer join on the filenames, a file missing on one side has no label. Both matrices are directly encoded with
+    # the same rows
+    filenames = pd.concat([reference.filename, estimated.filename]).unique()
+    _, encoded_ref = format_df_fast(reference, classes, filenames)
+    _, encoded_est = format_df_fast(estimated, classes, filenames)
 
     if not estimated.empty:
-        matching.event_label_pred = matching.event_label_pred.apply(na_values)
-        matching.event_label_ref = matching.event_label_ref.apply(na_values)
-
-        tp, fp, fn, tn = intermediate_at_measures(np.array(matching.event_label_ref.tolist()),
-                                                  np.array(matching.event_label_pred.tolist()))
+        tp, fp, fn, tn = intermediate_at_measures(encoded_ref, encoded_est)
         macro_res = macro_f_measure(tp, fp, fn)
     else:
         macro_res = np.zeros(len(classes))
 
-    results_serie = pd.DataFrame(macro_res, index=mhe.labels)
+    results_serie = pd.DataFrame(macro_res, index=classes)
     return results_serie[0]
 
 
+# Last PSDSEval object initialized with a groundtruth, see get_psds_eval
+_psds_cache = {}
+
+
+def get_psds_eval(groundtruth_df, meta_df, dtc_threshold=0.5, gtc_threshold=0.5, cttc_threshold=0.3):
+    """ Get a PSDSEval object initialized with the groundtruth, the groundtruth of the last call is kept so it is not
+    ingested again when called with the same dataframes objects (they should not be modified in place).
+    Each call returns a new object without operating points, only the ingested groundtruth is shared.
+
+    Args:
+        groundtruth_df: pd.DataFrame, the groundtruth with "filename" "onset" "offset" and "event_label" columns
+        meta_df: pd.DataFrame, the durations of the files with "filename" and "duration" columns
+        dtc_threshold: float, detection tolerance criterion
+        gtc_threshold: float, ground truth intersection criterion
+        cttc_threshold: float, cross-trigger tolerance criterion
+
+    Returns:
+        psds_eval.PSDSEval object, without operating points
+    """
+    key = (id(groundtruth_df), id(meta_df), dtc_threshold, gtc_threshold, cttc_threshold)
+    if key not in _psds_cache:
+        psds = PSDSEval(dtc_threshold, gtc_threshold, cttc_threshold, ground_truth=groundtruth_df, metadata=meta_df)
+        _psds_cache.clear()
+        # Keep the dataframes so their id cannot be reused by other objects
+        _psds_cache[key] = (groundtruth_df, meta_df, psds)
+    # Shallow copy, add_operating_point and clear_all_operating_points replace the operating points table instead of
+    # modifying it, so it is not shared with the other copies
+    psds = copy.copy(_psds_cache[key][2])
+    psds.clear_all_operating_points()
+    return psds
+
+
 def compute_psds_from_operating_points(list_predictions, groundtruth_df, meta_df, dtc_threshold=0.5, gtc_threshold=0.5,
                                        cttc_threshold=0.3):
-    psds = PSDSEval(dtc_threshold, gtc_threshold, cttc_threshold, ground_truth=groundtruth_df, metadata=meta_df)
+    """ Get a PSDSEval object with an operating point per prediction dataframe. Each call returns its own object
+    (only the ingested groundtruth is reused when called with the same dataframes, see get_psds_eval)
+    """
+    psds = get_psds_eval(groundtruth_df, meta_df, dtc_threshold, gtc_threshold, cttc_threshold)
     for prediction_df in list_predictions:
         psds.add_operating_point(prediction_df)
     return psds
 
 
-def compute_metrics(predictions, gtruth_df, meta_df):
-    events_metric = compute_sed_eval_metrics(predictions, gtruth_df)
+def compute_metrics(predictions, gtruth_df, meta_df, n_jobs=1):
+    events_metric = compute_sed_eval_metrics(predictions, gtruth_df, n_jobs=n_jobs)
     macro_f1_event = events_metric.results_class_wise_average_metrics()['f_measure']['f_measure']
     dtc_threshold, gtc_threshold, cttc_threshold = 0.5, 0.5, 0.3
-    psds = PSDSEval(dtc_threshold, gtc_threshold, cttc_threshold, ground_truth=gtruth_df, metadata=meta_df)
+    psds = get_psds_eval(gtruth_df, meta_df, dtc_threshold, gtc_threshold, cttc_threshold)
     psds_macro_f1, psds_f1_classes = psds.compute_macro_f_score(predictions)
     logger.info(f"F1_score (psds_eval) accounting cross triggers: {psds_macro_f1}")
     return macro_f1_event, psds_macro_f1
@@ -15,7 +15,7 @@ from torch import nn
 
 from data_utils.Desed import DESED
 from data_utils.DataLoad import DataLoadDf, ConcatDataset, MultiStreamBatchSampler
-from TestModel import _load_crnn
+from TestModel import _load_crnn, _compile_for_inference
 from evaluation_measures import get_predictions, psds_score, compute_psds_from_operating_points, compute_metrics
 from models.CRNN import CRNN
 import config as cfg
@@ -298,7 +298,8 @@ if __name__ == '__main__':
     concat_dataset = ConcatDataset(list_dataset)
     sampler = MultiStreamBatchSampler(concat_dataset, batch_sizes=batch_sizes)
     training_loader = DataLoader(concat_dataset, batch_sampler=sampler, num_workers=cfg.num_workers)
-    valid_synth_loader = DataLoader(valid_synth_data, batch_size=cfg.batch_size, num_workers=cfg.num_workers)
+    valid_synth_loader = DataLoader(valid_synth_data, batch_size=cfg.batch_size, num_workers=cfg.num_workers,
+                                    pin_memory=torch.cuda.is_available())
 
     # ##############
     # Model
@@ -349,6 +350,11 @@ if __name__ == '__main__':
     # Train
     # ##############
     results = pd.DataFrame(columns=["loss", "valid_synth_f1", "weak_metric", "global_valid"])
+    # Validation with synthetic data (dropping feature_filename for psds), the same dataframe at each epoch so psds
+    # ingests the groundtruth only once
+    valid_synth = dfs["valid_synthetic"].drop("feature_filename", axis=1)
+    # Compiled once for the validation predictions, it shares the parameters of crnn
+    crnn_predict = _compile_for_inference(crnn)
     for epoch in range(cfg.n_epoch):
         crnn.train()
         crnn_ema.train()
@@ -360,10 +366,8 @@ if __name__ == '__main__':
         # Validation
         crnn = crnn.eval()
         logger.info("\n ### Valid synthetic metric ### \n")
-        predictions = get_predictions(crnn, valid_synth_loader, many_hot_encoder.decode_strong, pooling_time_ratio,
-                                      median_window=median_window, save_predictions=None)
-        # Validation with synthetic data (dropping feature_filename for psds)
-        valid_synth = dfs["valid_synthetic"].drop("feature_filename", axis=1)
+        predictions = get_predictions(crnn_predict, valid_synth_loader, many_hot_encoder.decode_strong,
+                                      pooling_time_ratio, median_window=median_window, save_predictions=None)
         valid_synth_f1, psds_m_f1 = compute_metrics(predictions, valid_synth, durations_synth)
 
         # Update state
@@ -405,16 +409,17 @@ if __name__ == '__main__':
     # Validation
     # ##############
     crnn.eval()
+    crnn_predict = _compile_for_inference(crnn)
     transforms_valid = get_transforms(cfg.max_frames, scaler, add_axis_conv)
     predicitons_fname = os.path.join(saved_pred_dir, "baseline_validation.tsv")
 
     validation_data = DataLoadDf(dfs["validation"], encod_func, transform=transforms_valid, return_indexes=True)
     validation_dataloader = DataLoader(validation_data, batch_size=cfg.batch_size, shuffle=False, drop_last=False,
-                                       num_workers=cfg.num_workers)
+                                       num_workers=cfg.num_workers, pin_memory=torch.cuda.is_available())
     validation_labels_df = dfs["validation"].drop("feature_filename", axis=1)
     durations_validation = get_durations_df(cfg.validation, cfg.audio_validation_dir)
     # Preds with only one value
-    valid_predictions = get_predictions(crnn, validation_dataloader, many_hot_encoder.decode_strong,
+    valid_predictions = get_predictions(crnn_predict, validation_dataloader, many_hot_encoder.decode_strong,
                                         pooling_time_ratio, median_window=median_window,
                                         save_predictions=predicitons_fname)
     compute_metrics(valid_predictions, validation_labels_df, durations_validation)
@@ -426,7 +431,7 @@ if __name__ == '__main__':
     n_thresholds = 50
     # Example of 5 thresholds: 0.1, 0.3, 0.5, 0.7, 0.9
     list_thresholds = np.arange(1 / (n_thresholds * 2), 1, 1 / n_thresholds)
-    pred_ss_thresh = get_predictions(crnn, validation_dataloader, many_hot_encoder.decode_strong,
+    pred_ss_thresh = get_predictions(crnn_predict, validation_dataloader, many_hot_encoder.decode_strong,
                                      pooling_time_ratio, thresholds=list_thresholds, median_window=median_window,
                                      save_predictions=predicitons_fname)
     psds = compute_psds_from_operating_points(pred_ss_thresh, validation_labels_df, durations_validation)
@@ -0,0 +1,164 @@
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional, a numpy implementation is used instead
+    njit = None
+    prange = range
+
+
+def _reflect_index(t, n_frames):
+    """ Index of frame t in a signal of n_frames extended with scipy's default 'reflect' mode (d c b a | a b c d) """
+    period = 2 * n_frames
+    t = t % period
+    if t >= n_frames:
+        t = period - 1 - t
+    return t
+
+
+def _binary_median_filter_loops(pred, median_window):
+    n_frames, n_classes = pred.shape
+    half = median_window // 2
+    min_active = (median_window + 1) // 2
+
+    filtered = np.empty_like(pred)
+    for c in prange(n_classes):
+        running_sum = 0
+        for k in range(median_window):
+            running_sum += pred[_reflect_index(k - half, n_frames), c]
+        for t in range(n_frames):
+            filtered[t, c] = 1 if running_sum >= min_active else 0
+            running_sum += pred[_reflect_index(t + median_window - half, n_frames), c]
+            running_sum -= pred[_reflect_index(t - half, n_frames), c]
+    return filtered
+
+
+def _binary_median_filter_numpy(pred, median_window):
+    """ Median filter along the time axis (second to last axis) with a cumulative sum """
+    n_frames = pred.shape[-2]
+    half = median_window // 2
+    pad_width = [(0, 0)] * pred.ndim
+    pad_width[-2] = (half, median_window - 1 - half)
+    # np.pad 'symmetric' is scipy's 'reflect'
+    padded = np.pad(pred, pad_width, mode="symmetric").astype(np.int64)
+    cumsum = np.cumsum(padded, axis=-2)
+    cumsum = np.concatenate((np.zeros_like(cumsum[..., :1, :]), cumsum), axis=-2)
+    running_sum = cumsum[..., median_window:median_window + n_frames, :] - cumsum[..., :n_frames, :]
+    return (running_sum >= (median_window + 1) // 2).astype(pred.dtype)
+
+
+def _decode_batch_loops(pred, median_window):
+    n_batch, n_frames, n_classes = pred.shape
+    half = median_window // 2
+    min_active = (median_window + 1) // 2
+
+    # Median filter on binary values: majority vote in a sliding window
+    filtered = np.empty((n_batch, n_classes, n_frames), dtype=np.uint8)
+    n_events = 0
+    for b in range(n_batch):
+        for c in range(n_classes):
+            running_sum = 0
+            for k in range(median_window):
+                running_sum += pred[b, _reflect_index(k - half, n_frames), c]
+            previous = 0
+            for t in range(n_frames):
+                filtered[b, c, t] = 1 if running_sum >= min_active else 0
+                if filtered[b, c, t] == 1 and previous == 0:
+                    n_events += 1
+                previous = filtered[b, c, t]
+                running_sum += pred[b, _reflect_index(t + median_window - half, n_frames), c]
+                running_sum -= pred[b, _reflect_index(t - half, n_frames), c]
+
+    # Run length decoding, offset excluded
+    file_idx = np.empty(n_events, dtype=np.int64)
+    class_idx = np.empty(n_events, dtype=np.int64)
+    onsets = np.empty(n_events, dtype=np.int64)
+    offsets = np.empty(n_events, dtype=np.int64)
+    n_events = 0
+    for b in range(n_batch):
+        for c in range(n_classes):
+            onset = -1
+            for t in range(n_frames + 1):
+                active = t < n_frames and filtered[b, c, t] == 1
+                if active and onset < 0:
+                    onset = t
+                elif not active and onset >= 0:
+                    file_idx[n_events] = b
+                    class_idx[n_events] = c
+                    onsets[n_events] = onset
+                    offsets[n_events] = t
+                    n_events += 1
+                    onset = -1
+    return file_idx, class_idx, onsets, offsets
+
+
+def _decode_batch_numpy(pred, median_window):
+    filtered = _binary_median_filter_numpy(pred, median_window).astype(np.int8)
+
+    # (batch, classes, frames) so nonzero returns the events ordered by file, class and onset
+    filtered = np.pad(filtered.transpose(0, 2, 1), ((0, 0), (0, 0), (1, 1)))
+    changes = np.diff(filtered, axis=-1)
+    file_idx, class_idx, onsets = np.nonzero(changes == 1)
+    offsets = np.nonzero(changes == -1)[2]
+    return file_idx.astype(np.int64), class_idx.astype(np.int64), onsets.astype(np.int64), offsets.astype(np.int64)
+
+
+if njit is not None:
+    _reflect_index = njit(cache=True)(_reflect_index)
+    _binary_median_filter = njit(parallel=True, cache=True)(_binary_median_filter_loops)
+    _decode_batch = njit(cache=True)(_decode_batch_loops)
+else:
+    _binary_median_filter = _binary_median_filter_numpy
+    _decode_batch = _decode_batch_numpy
+
+
+def binarize(pred, thresh):
+    """ Binarize probabilities with a global threshold or a threshold per class
+
+    Args:
+        pred: np.array, the probabilities, classes on the last axis
+        thresh: float or list, the global threshold or the threshold of each class
+
+    Returns:
+        np.array
+        bool array with the shape of pred, True where pred >= thresh
+    """
+    thresh = np.asarray(thresh, dtype=pred.dtype)
+    return pred >= thresh
+
+
+def binary_median_filter(pred, median_window=1):
+    """ Median filter of binary predictions along the time axis
+
+    Equivalent to scipy.ndimage.median_filter(pred, (median_window, 1)): on binary values the median is 1 when at
+    least half of the window is 1, so a sliding sum is enough (compiled with numba if available, classes in parallel)
+
+    Args:
+        pred: np.array, binary predictions of shape (time_steps, n_labels)
+        median_window: int, the median window (in number of time steps) to be applied
+
+    Returns:
+        np.array
+        uint8 array of shape (time_steps, n_labels), the filtered predictions
+    """
+    pred = np.ascontiguousarray(pred, dtype=np.uint8)
+    return _binary_median_filter(pred, int(median_window))
+
+
+def decode_batch(pred, median_window=1):
+    """ Median filter and decode a batch of binarized strong predictions
+
+    Equivalent to applying scipy.ndimage.median_filter with a window (median_window, 1) and then
+    ManyHotEncoder.decode_strong on each element of the batch, but in a single pass (compiled with numba if available)
+
+    Args:
+        pred: np.array, binary predictions of shape (batch, time_steps, n_labels)
+        median_window: int, the median window (in number of time steps) to be applied
+
+    Returns:
+        tuple
+        (file indexes, class indexes, onsets, offsets) int64 arrays with one value per event, onsets and offsets in
+        frames (offset not included), ordered by file, class and onset
+    """
+    pred = np.ascontiguousarray(pred, dtype=np.uint8)
+    return _decode_batch(pred, int(median_window))
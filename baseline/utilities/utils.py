@@ -1,5 +1,6 @@
 from __future__ import print_function
 
+import contextlib
 import glob
 import warnings
 
@@ -59,10 +60,12 @@ def weights_init(m):
         m.bias.data.zero_()
 
 
-def to_cuda_if_available(*args):
+def to_cuda_if_available(*args, non_blocking=False):
     """ Transfer object (Module, Tensor) to GPU if GPU available
     Args:
         args: torch object to put on cuda if available (needs to have object.cuda() defined)
+        non_blocking: bool, (Default value = False) asynchronous copy of tensors (only asynchronous when they are in
+            pinned memory, see DataLoader pin_memory), not supported by Modules
 
     Returns:
         Objects on GPU if GPUs available
@@ -70,12 +73,39 @@ def to_cuda_if_available(*args):
     res = list(args)
     if torch.cuda.is_available():
         for i, torch_obj in enumerate(args):
-            res[i] = torch_obj.cuda()
+            if non_blocking:
+                res[i] = torch_obj.cuda(non_blocking=True)
+            else:
+                res[i] = torch_obj.cuda()
     if len(res) == 1:
         return res[0]
     return res
 
 
+@contextlib.contextmanager
+def inference_context():
+    """ Context for the forward passes of predictions: no autograd (torch.inference_mode if torch >= 1.9, otherwise
+    torch.no_grad) and float16 autocast on GPU (torch >= 1.10)
+    """
+    grad_context = torch.inference_mode() if hasattr(torch, "inference_mode") else torch.no_grad()
+    with grad_context:
+        if hasattr(torch, "autocast") and torch.cuda.is_available():
+            with torch.autocast("cuda", dtype=torch.float16):
+                yield
+        else:
+            yield
+
+
+def set_inference_backends():
+    """ TF32 matmul/convolutions (torch >= 1.7) and cudnn autotuning (inputs always have the same size),
+    to be called by the scripts only making predictions, it changes the numerics of training
+    """
+    if hasattr(torch.backends.cudnn, "allow_tf32"):
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+    torch.backends.cudnn.benchmark = True
+
+
 class SaveBest:
     """ Callback to get the best value and epoch
     Args:
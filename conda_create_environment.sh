@@ -2,6 +2,7 @@
 conda create -y -n dcase2020 python=3.6
 source activate dcase2020
 conda install -y pandas h5py scipy
+conda install -y numba # optional, compiles the decoding of predictions
 conda install -y pytorch torchvision cudatoolkit=9.1 -c pytorch # for gpu install (or cpu in MAC)
 # conda install pytorch-cpu torchvision-cpu -c pytorch (cpu linux)
 conda install -y pysoundfile librosa youtube-dl tqdm -c conda-forge